@@ -1,14 +1,28 @@
 import os
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Any
 
+import httpx
 from dotenv import find_dotenv, load_dotenv
-
-from agents import Agent, AsyncOpenAI, OpenAIChatCompletionsModel, Runner, function_tool
+from pydantic import BaseModel
+
+from agents import (
+    Agent,
+    AsyncOpenAI,
+    OpenAIChatCompletionsModel,
+    RunContextWrapper,
+    Runner,
+    Session,
+    SQLiteSession,
+    function_tool,
+)
 
 import db
-from menu import Menu, find_extra, find_pizza, format_menu_for_chat, load_menu
+from menu import SIZE_INDEX, SIZE_ORDER, Menu, find_extra, find_pizza, load_menu
 
 
+@lru_cache(maxsize=1)
 def build_model() -> OpenAIChatCompletionsModel:
     # Gemini OpenAI-compatible endpoint
     # Docs: https://ai.google.dev/ (OpenAI compatibility)
@@ -21,7 +35,13 @@ def build_model() -> OpenAIChatCompletionsModel:
     if not api_key:
         raise ValueError("GEMINI_API_KEY is missing. Put it in .env or your environment.")
 
-    external_client: AsyncOpenAI = AsyncOpenAI(api_key=api_key, base_url=base_url)
+    # Cached above, so one pooled HTTP client is shared for the whole process.
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        http2=True,
+        timeout=60.0,
+    )
+    external_client: AsyncOpenAI = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
     llm_model: OpenAIChatCompletionsModel = OpenAIChatCompletionsModel(
         model=model,
         openai_client=external_client,
@@ -29,8 +49,11 @@ def build_model() -> OpenAIChatCompletionsModel:
     return llm_model
 
 
-def build_agent(conn, menu: Menu) -> Agent:
-    system = """
+PIZZA_SIZES = frozenset(SIZE_ORDER)
+DELIVERY_TYPES = frozenset({"delivery", "pickup"})
+
+
+SYSTEM_PROMPT = """
 You are PizzaBot, a friendly and efficient pizza ordering assistant.
 
 You must:
@@ -48,143 +71,232 @@ Status flow suggestion:
 - draft -> placed -> preparing -> baking -> out_for_delivery -> delivered (or ready_for_pickup)
 """.strip()
 
-    @function_tool
-    def get_menu() -> dict[str, Any]:
-        """Return the current menu and fees."""
-        return {
-            "menu_text": format_menu_for_chat(menu),
-            "delivery_fee": menu.delivery_fee,
-            "tax_percent": menu.tax_percent,
-            "pizzas": menu.pizzas,
-            "extras": menu.extras,
-        }
-
-    @function_tool
-    def start_order(delivery_type: str, customer_name: str | None = None, phone: str | None = None, address: str | None = None, notes: str | None = None) -> dict[str, Any]:
-        """Create a new draft order and return order_id."""
-        delivery_type = delivery_type.strip().lower()
-        if delivery_type not in {"delivery", "pickup"}:
-            raise ValueError("delivery_type must be 'delivery' or 'pickup'")
 
+@dataclass
+class PizzaContext:
+    # Passed to Runner as the run context; tools read conn/menu from it so the
+    # tool registry below can be built once at import time.
+    conn: Any
+    menu: Menu
+    order_id: int | None = None  # the customer's active order, if known
+
+
+@function_tool
+def get_menu(ctx: RunContextWrapper[PizzaContext]) -> dict[str, Any]:
+    """Return the current menu and fees."""
+    menu = ctx.context.menu
+    return {
+        "menu_text": menu.menu_text,
+        "delivery_fee": menu.delivery_fee,
+        "tax_percent": menu.tax_percent,
+        "pizzas": menu.pizzas,
+        "extras": menu.extras,
+    }
+
+
+@function_tool
+def start_order(ctx: RunContextWrapper[PizzaContext], delivery_type: str, customer_name: str | None = None, phone: str | None = None, address: str | None = None, notes: str | None = None) -> dict[str, Any]:
+    """Create a new draft order and return order_id."""
+    conn = ctx.context.conn
+    delivery_type = delivery_type.strip().lower()
+    if delivery_type not in DELIVERY_TYPES:
+        raise ValueError("delivery_type must be 'delivery' or 'pickup'")
+
+    with db.transaction(conn):
         customer_id = None
         if customer_name and customer_name.strip():
             customer_id = db.create_customer(conn, customer_name, phone)
 
         order_id = db.create_order(conn, customer_id, delivery_type, address=address, notes=notes)
-        return {"order_id": order_id}
-
-    @function_tool
-    def add_pizza(order_id: int, pizza_id: str, size: str, qty: int = 1) -> dict[str, Any]:
-        """Add a pizza item to an order."""
-        size = size.strip().lower()
-        if size not in {"small", "medium", "large"}:
-            raise ValueError("size must be one of: small, medium, large")
-        pizza = find_pizza(menu, pizza_id)
-        if not pizza:
-            raise ValueError(f"Unknown pizza_id: {pizza_id}")
-        unit_price = int(pizza["sizes"][size])
-        db.add_order_item(
-            conn,
-            order_id=int(order_id),
-            item_type="pizza",
-            item_id=str(pizza["id"]),
-            item_name=str(pizza["name"]),
-            size=size,
-            qty=int(qty),
-            unit_price=unit_price,
-        )
-        return db.get_order(conn, int(order_id)) or {"error": "order not found"}
-
-    @function_tool
-    def add_extra(order_id: int, extra_id: str, qty: int = 1) -> dict[str, Any]:
-        """Add an extra item to an order."""
-        extra = find_extra(menu, extra_id)
-        if not extra:
-            raise ValueError(f"Unknown extra_id: {extra_id}")
-        db.add_order_item(
-            conn,
-            order_id=int(order_id),
-            item_type="extra",
-            item_id=str(extra["id"]),
-            item_name=str(extra["name"]),
-            size=None,
-            qty=int(qty),
-            unit_price=int(extra["price"]),
-        )
-        return db.get_order(conn, int(order_id)) or {"error": "order not found"}
-
-    @function_tool
-    def remove_item(order_item_id: int) -> dict[str, Any]:
-        """Remove an order item by its order_item_id."""
-        db.remove_order_item(conn, int(order_item_id))
-        return {"ok": True}
-
-    @function_tool
-    def checkout(order_id: int) -> dict[str, Any]:
-        """Finalize the order: set status to placed and return totals."""
-        payload = db.get_order(conn, int(order_id))
-        if not payload:
+    return {"order_id": order_id}
+
+
+def _pizza_item(menu: Menu, pizza_id: str, size: str, qty: int) -> dict[str, Any]:
+    size = size.strip().lower()
+    if size not in PIZZA_SIZES:
+        raise ValueError(f"size must be one of: {', '.join(SIZE_ORDER)}")
+    # Same normalized key as find_pizza, reused for the price lookup.
+    pid = pizza_id.strip().lower()
+    pizza = menu.pizzas_by_id.get(pid)
+    if not pizza:
+        raise ValueError(f"Unknown pizza_id: {pizza_id}")
+    unit_price = menu.prices_by_id[pid][SIZE_INDEX[size]]
+    if unit_price is None:
+        raise ValueError(f"{pizza['name']} is not available in size {size}")
+    return {
+        "item_type": "pizza",
+        "item_id": str(pizza["id"]),
+        "item_name": str(pizza["name"]),
+        "size": size,
+        "qty": int(qty),
+        "unit_price": unit_price,
+    }
+
+
+def _extra_item(menu: Menu, extra_id: str, qty: int) -> dict[str, Any]:
+    extra = find_extra(menu, extra_id)
+    if not extra:
+        raise ValueError(f"Unknown extra_id: {extra_id}")
+    return {
+        "item_type": "extra",
+        "item_id": str(extra["id"]),
+        "item_name": str(extra["name"]),
+        "size": None,
+        "qty": int(qty),
+        "unit_price": int(extra["price"]),
+    }
+
+
+@function_tool
+def add_pizza(ctx: RunContextWrapper[PizzaContext], order_id: int, pizza_id: str, size: str, qty: int = 1) -> dict[str, Any]:
+    """Add a pizza item to an order."""
+    conn = ctx.context.conn
+    item = _pizza_item(ctx.context.menu, pizza_id, size, qty)
+    with db.transaction(conn):
+        db.add_order_item(conn, order_id=int(order_id), **item)
+    return db.get_order(conn, int(order_id)) or {"error": "order not found"}
+
+
+@function_tool
+def add_extra(ctx: RunContextWrapper[PizzaContext], order_id: int, extra_id: str, qty: int = 1) -> dict[str, Any]:
+    """Add an extra item to an order."""
+    conn = ctx.context.conn
+    item = _extra_item(ctx.context.menu, extra_id, qty)
+    with db.transaction(conn):
+        db.add_order_item(conn, order_id=int(order_id), **item)
+    return db.get_order(conn, int(order_id)) or {"error": "order not found"}
+
+
+class CartItem(BaseModel):
+    item_id: str  # pizza_id or extra_id
+    size: str | None = None  # required for pizzas
+    qty: int = 1
+
+
+@function_tool
+def add_items(ctx: RunContextWrapper[PizzaContext], order_id: int, items: list[CartItem]) -> dict[str, Any]:
+    """Add several pizzas and/or extras to an order in one call."""
+    conn = ctx.context.conn
+    menu = ctx.context.menu
+    rows: list[dict[str, Any]] = []
+    for it in items:
+        if find_pizza(menu, it.item_id):
+            if not it.size:
+                raise ValueError(f"size is required for pizza_id: {it.item_id}")
+            rows.append(_pizza_item(menu, it.item_id, it.size, it.qty))
+        else:
+            rows.append(_extra_item(menu, it.item_id, it.qty))
+    with db.transaction(conn):
+        db.add_order_items_bulk(conn, int(order_id), rows)
+    return db.get_order(conn, int(order_id)) or {"error": "order not found"}
+
+
+@function_tool
+def remove_item(ctx: RunContextWrapper[PizzaContext], order_item_id: int) -> dict[str, Any]:
+    """Remove an order item by its order_item_id."""
+    conn = ctx.context.conn
+    db.remove_order_item(conn, int(order_item_id))
+    return {"ok": True}
+
+
+@function_tool
+def checkout(ctx: RunContextWrapper[PizzaContext], order_id: int) -> dict[str, Any]:
+    """Finalize the order: set status to placed and return totals."""
+    conn = ctx.context.conn
+    menu = ctx.context.menu
+    with db.transaction(conn):
+        order = db.get_order_summary(conn, int(order_id))
+        if not order:
             raise ValueError("Order not found")
 
-        order = payload["order"]
-        if not payload["items"]:
+        if not order["item_count"]:
             raise ValueError("Order has no items")
 
         delivery_fee = menu.delivery_fee if order["delivery_type"] == "delivery" else 0
-        totals = db.compute_totals(payload["items"], delivery_fee=delivery_fee, tax_percent=menu.tax_percent)
+        totals = db.compute_totals_sql(conn, int(order_id), delivery_fee=delivery_fee, tax_percent=menu.tax_percent)
 
         db.set_order_status(conn, int(order_id), "placed", message="Order placed")
-        return {"order": db.get_order(conn, int(order_id)), "totals": totals.__dict__}
+    return {"order": db.get_order(conn, int(order_id)), "totals": totals.__dict__}
 
-    @function_tool
-    def get_order_status(order_id: int) -> dict[str, Any]:
-        """Get an order along with status updates."""
-        payload = db.get_order(conn, int(order_id))
-        if not payload:
-            raise ValueError("Order not found")
-        return payload
 
-    @function_tool
-    def admin_update_status(order_id: int, status: str, message: str | None = None) -> dict[str, Any]:
-        """Admin tool: update order status."""
+@function_tool
+def get_order_status(ctx: RunContextWrapper[PizzaContext], order_id: int) -> dict[str, Any]:
+    """Get an order along with status updates."""
+    conn = ctx.context.conn
+    payload = db.get_order(conn, int(order_id))
+    if not payload:
+        raise ValueError("Order not found")
+    return payload
+
+
+@function_tool
+def admin_update_status(ctx: RunContextWrapper[PizzaContext], order_id: int, status: str, message: str | None = None) -> dict[str, Any]:
+    """Admin tool: update order status."""
+    conn = ctx.context.conn
+    with db.transaction(conn):
         db.set_order_status(conn, int(order_id), status.strip().lower(), message=message)
-        return db.get_order(conn, int(order_id)) or {"error": "order not found"}
+    return db.get_order(conn, int(order_id)) or {"error": "order not found"}
+
+
+TOOLS = [
+    get_menu,
+    start_order,
+    add_pizza,
+    add_extra,
+    add_items,
+    remove_item,
+    checkout,
+    get_order_status,
+    admin_update_status,
+]
 
-    model = build_model()
-    return Agent(
+
+def _instructions(ctx: RunContextWrapper[PizzaContext], agent: Agent[PizzaContext]) -> str:
+    # The active order is hinted per run rather than stored in the session history.
+    order_id = ctx.context.order_id
+    if order_id:
+        return f"{SYSTEM_PROMPT}\n\nContext: the customer's current order_id is {order_id}."
+    return SYSTEM_PROMPT
+
+
+def build_agent() -> Agent[PizzaContext]:
+    return Agent[PizzaContext](
         name="PizzaBot",
-        instructions=system,
-        model=model,
-        tools=[
-            get_menu,
-            start_order,
-            add_pizza,
-            add_extra,
-            remove_item,
-            checkout,
-            get_order_status,
-            admin_update_status,
-        ],
+        instructions=_instructions,
+        model=build_model(),
+        tools=TOOLS,
     )
 
 
-def run_turn(agent: Agent, user_message: str, chat_history: list[dict[str, str]] | None = None) -> dict[str, Any]:
-    # Runner.run_sync supports either a plain string input or a list of message items.
-    # We pass a list so the agent can maintain conversation.
-    messages: list[dict[str, str]] = []
-    if chat_history:
-        messages.extend(chat_history)
-    messages.append({"role": "user", "content": user_message})
+def new_session(session_id: str) -> Session:
+    # In-memory conversation store; Runner loads prior turns from it and
+    # appends the new ones, so callers only pass the latest user message.
+    return SQLiteSession(session_id)
 
-    result = Runner.run_sync(starting_agent=agent, input=messages)
+
+async def run_turn_async(
+    agent: Agent,
+    context: PizzaContext,
+    user_message: str,
+    session: Session | None = None,
+) -> dict[str, Any]:
+    result = await Runner.run(starting_agent=agent, input=user_message, context=context, session=session)
     return {
         "output": getattr(result, "final_output", None) or str(result),
         "raw": result,
     }
 
 
+_ENV_LOADED = False
+
+
 def load_env() -> None:
-    load_dotenv(find_dotenv(), override=True)
+    # Only once per process; values already set in the environment win over .env.
+    global _ENV_LOADED
+    if _ENV_LOADED:
+        return
+    load_dotenv(find_dotenv(), override=False)
+    _ENV_LOADED = True
 
 
 def build_runtime(db_path: str, menu_path: str) -> tuple[Any, Menu, Agent]:
@@ -192,5 +304,5 @@ def build_runtime(db_path: str, menu_path: str) -> tuple[Any, Menu, Agent]:
     conn = db.connect(db_path)
     db.init_db(conn)
     menu = load_menu(menu_path)
-    agent = build_agent(conn, menu)
+    agent = build_agent()
     return conn, menu, agent
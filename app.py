@@ -1,24 +1,134 @@
+import asyncio
 import os
+import re
+import threading
+import uuid
 from pathlib import Path
 
 import streamlit as st
 
 import db
-from agent import build_runtime, run_turn
+from agent import PizzaContext, build_runtime, new_session, run_turn_async
 
 
 st.set_page_config(page_title="PizzaBot", page_icon="🍕", layout="wide")
 
+# Whole whitespace-delimited digit tokens only, so prices like "1,399" don't match.
+_ORDER_RE = re.compile(r"(?<!\S)(\d+)(?!\S)")
+
 
 def money(pkr: int) -> str:
     return f"PKR {int(pkr):,}"
 
 
+@st.cache_resource
+def get_runtime(db_path: str, menu_path: str):
+    # Shared across all sessions and reruns; the sqlite connection is opened
+    # with check_same_thread=False so Streamlit's script threads can share it.
+    return build_runtime(db_path=db_path, menu_path=menu_path)
+
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    # One loop per process, running in a background thread. Sessions submit
+    # their turns to it so concurrent LLM round-trips overlap instead of
+    # each blocking its own script thread on a fresh loop.
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="pizzabot-loop", daemon=True).start()
+    return loop
+
+
+def run_turn_on_loop(agent, context: PizzaContext, user_text: str, session) -> dict:
+    future = asyncio.run_coroutine_threadsafe(
+        run_turn_async(agent, context, user_text, session=session), get_event_loop()
+    )
+    return future.result()
+
+
 def ensure_state() -> None:
     if "chat" not in st.session_state:
         st.session_state.chat = []  # list[dict(role, content)]
     if "order_id" not in st.session_state:
         st.session_state.order_id = None
+    if "session" not in st.session_state:
+        st.session_state.session = new_session(uuid.uuid4().hex)  # agent-side history
+
+
+def render_current_order(conn, menu) -> None:
+    st.subheader("Current Order")
+    if not st.session_state.order_id:
+        st.info("No active order yet. Start by telling the bot: 'I want delivery' or 'I want pickup'.")
+        return
+
+    payload = db.get_order(conn, st.session_state.order_id)
+    if not payload:
+        st.warning("Order not found in DB")
+        return
+
+    order = payload["order"]
+    items = payload["items"]
+    delivery_fee = menu.delivery_fee if order["delivery_type"] == "delivery" else 0
+    totals = db.compute_totals(items, delivery_fee=delivery_fee, tax_percent=menu.tax_percent)
+
+    st.write(f"Order ID: {order['id']}")
+    st.write(f"Status: {order['status']}")
+    st.write(f"Type: {order['delivery_type']}")
+
+    st.markdown("**Items**")
+    if not items:
+        st.write("(No items yet)")
+    for it in items:
+        label = it["item_name"]
+        if it["size"]:
+            label += f" ({it['size']})"
+        st.write(f"- {it['qty']} × {label} @ {money(it['unit_price'])}")
+
+    st.markdown("**Totals**")
+    st.write(f"Subtotal: {money(totals.subtotal)}")
+    st.write(f"Delivery: {money(totals.delivery_fee)}")
+    st.write(f"Tax: {money(totals.tax)}")
+    st.write(f"Total: {money(totals.total)}")
+
+
+@st.fragment
+def chat_pane(agent, conn, menu) -> None:
+    # Submitting a message reruns only this fragment, not the menu or admin tab.
+    left, right = st.columns([2, 1], gap="large")
+
+    with left:
+        st.subheader("Chat")
+
+        history = st.container()
+        with history:
+            for msg in st.session_state.chat:
+                with st.chat_message(msg["role"]):
+                    st.markdown(msg["content"])
+
+        user_text = st.chat_input("Ask about menu, place an order, or check status...")
+        if user_text:
+            st.session_state.chat.append({"role": "user", "content": user_text})
+            with history:
+                with st.chat_message("user"):
+                    st.markdown(user_text)
+
+            # Hint the agent about an existing order_id via the run context
+            context = PizzaContext(conn=conn, menu=menu, order_id=st.session_state.order_id)
+            result = run_turn_on_loop(agent, context, user_text, session=st.session_state.session)
+            assistant_text = result["output"]
+            st.session_state.chat.append({"role": "assistant", "content": assistant_text})
+            with history:
+                with st.chat_message("assistant"):
+                    st.markdown(assistant_text)
+
+            # Try to detect an order_id from tool usage (fallback: parse digits in response)
+            # We keep this simple; user can also ask the bot: "what's my order id?"
+            m = _ORDER_RE.search(assistant_text)
+            if m:
+                st.session_state.order_id = int(m.group(1))
+
+    # Drawn after the turn so it reflects any items the agent just added.
+    with right:
+        render_current_order(conn, menu)
 
 
 def main() -> None:
@@ -29,94 +139,27 @@ def main() -> None:
     db_path = os.getenv("PIZZA_DB_PATH", "pizza.db")
     menu_path = os.getenv("PIZZA_MENU_PATH", "menu.json")
 
-    # Build runtime once per session
-    if "runtime" not in st.session_state:
-        conn, menu, agent = build_runtime(db_path=db_path, menu_path=menu_path)
-        st.session_state.runtime = {"conn": conn, "menu": menu, "agent": agent}
+    # Build runtime once per process
+    conn, menu, agent = get_runtime(db_path, menu_path)
 
-    conn = st.session_state.runtime["conn"]
-    menu = st.session_state.runtime["menu"]
-    agent = st.session_state.runtime["agent"]
+    with st.sidebar:
+        st.subheader("Menu")
+        st.caption("Quick reference")
+        for p in menu.pizzas:
+            st.markdown(
+                f"**{p['name']}** ({p['id']})\n\n{p.get('description','')}\n\n"
+                f"S {money(p['sizes']['small'])} • M {money(p['sizes']['medium'])} • L {money(p['sizes']['large'])}"
+            )
+            st.divider()
 
     tab_chat, tab_admin = st.tabs(["Customer Chat", "Admin / Kitchen"])
 
     with tab_chat:
-        left, right = st.columns([2, 1], gap="large")
-
-        with left:
-            st.subheader("Chat")
-
-            for msg in st.session_state.chat:
-                with st.chat_message(msg["role"]):
-                    st.markdown(msg["content"])
-
-            user_text = st.chat_input("Ask about menu, place an order, or check status...")
-            if user_text:
-                st.session_state.chat.append({"role": "user", "content": user_text})
-
-                # Hint the agent about an existing order_id if present
-                order_id = st.session_state.order_id
-                if order_id:
-                    user_text = f"(context: current order_id is {order_id})\n" + user_text
-
-                result = run_turn(agent, user_text, chat_history=st.session_state.chat[:-1])
-                assistant_text = result["output"]
-                st.session_state.chat.append({"role": "assistant", "content": assistant_text})
-
-                # Try to detect an order_id from tool usage (fallback: parse digits in response)
-                # We keep this simple; user can also ask the bot: "what's my order id?"
-                for token in assistant_text.split():
-                    if token.isdigit():
-                        st.session_state.order_id = int(token)
-                        break
-
-                st.rerun()
-
-        with right:
-            st.subheader("Menu")
-            st.caption("Quick reference")
-            for p in menu.pizzas:
-                st.markdown(
-                    f"**{p['name']}** ({p['id']})\n\n{p.get('description','')}\n\n"
-                    f"S {money(p['sizes']['small'])} • M {money(p['sizes']['medium'])} • L {money(p['sizes']['large'])}"
-                )
-                st.divider()
-
-            st.subheader("Current Order")
-            if st.session_state.order_id:
-                payload = db.get_order(conn, st.session_state.order_id)
-                if payload:
-                    order = payload["order"]
-                    items = payload["items"]
-                    delivery_fee = menu.delivery_fee if order["delivery_type"] == "delivery" else 0
-                    totals = db.compute_totals(items, delivery_fee=delivery_fee, tax_percent=menu.tax_percent)
-
-                    st.write(f"Order ID: {order['id']}")
-                    st.write(f"Status: {order['status']}")
-                    st.write(f"Type: {order['delivery_type']}")
-
-                    st.markdown("**Items**")
-                    if not items:
-                        st.write("(No items yet)")
-                    for it in items:
-                        label = it["item_name"]
-                        if it["size"]:
-                            label += f" ({it['size']})"
-                        st.write(f"- {it['qty']} × {label} @ {money(it['unit_price'])}")
-
-                    st.markdown("**Totals**")
-                    st.write(f"Subtotal: {money(totals.subtotal)}")
-                    st.write(f"Delivery: {money(totals.delivery_fee)}")
-                    st.write(f"Tax: {money(totals.tax)}")
-                    st.write(f"Total: {money(totals.total)}")
-                else:
-                    st.warning("Order not found in DB")
-            else:
-                st.info("No active order yet. Start by telling the bot: 'I want delivery' or 'I want pickup'.")
+        chat_pane(agent, conn, menu)
 
     with tab_admin:
         st.subheader("Orders")
-        orders = db.list_orders(conn, limit=50)
+        orders = db.list_orders_df(conn, limit=50)
         st.dataframe(orders, use_container_width=True)
 
         st.subheader("Update status")
@@ -140,7 +183,8 @@ def main() -> None:
             message = st.text_input("Message (optional)")
 
         if st.button("Apply update"):
-            db.set_order_status(conn, int(order_id), status, message=message or None)
+            with db.transaction(conn):
+                db.set_order_status(conn, int(order_id), status, message=message or None)
             st.success("Updated")
 
         st.subheader("View order")
@@ -151,6 +195,11 @@ def main() -> None:
         else:
             st.info("No such order")
 
+        st.subheader("Compare recent orders")
+        view_ids = st.multiselect("Order IDs", orders["id"].tolist(), key="view_ids")
+        for payload in db.get_orders_bulk(conn, view_ids):
+            st.json(payload)
+
 
 if __name__ == "__main__":
     main()
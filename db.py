@@ -1,8 +1,40 @@
+import json
 import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Iterable, Iterator
+
+import pandas as pd
+
+
+# The runtime shares one connection across Streamlit's script threads and the
+# agent loop thread, so every write goes through transaction(), which holds
+# this lock for the whole BEGIN ... COMMIT. The sync agent tools take it on the
+# event-loop thread, so in-flight turns wait while another thread writes; that
+# is accepted because each transaction is only a few statements.
+_tx_lock = threading.Lock()
+# Per thread: id()s of the connections with a transaction open on this thread.
+_tx_state = threading.local()
+
+
+def _open_txs() -> set[int]:
+    if not hasattr(_tx_state, "conns"):
+        _tx_state.conns = set()
+    return _tx_state.conns
+
+
+# Hot statements live in constants so every call site passes the identical
+# string and hits sqlite3's per-connection prepared-statement cache.
+SQL_INSERT_ITEM = """
+    INSERT INTO order_items(order_id, item_type, item_id, item_name, size, qty, unit_price, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_INSERT_UPDATE = "INSERT INTO order_updates(order_id, status, message, created_at) VALUES (?, ?, ?, ?)"
+SQL_TOUCH_ORDER = "UPDATE orders SET updated_at=? WHERE id=?"
+SQL_LIST_ORDERS = "SELECT * FROM orders ORDER BY id DESC LIMIT ?"
 
 
 def utc_now_iso() -> str:
@@ -21,9 +53,44 @@ def connect(db_path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(db_path, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -65536")  # 64 MiB page cache
     return conn
 
 
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Group several writes under one BEGIN IMMEDIATE ... COMMIT.
+
+    Nested calls for the same connection on the same thread join the outer
+    transaction.
+    """
+    open_txs = _open_txs()
+    if id(conn) in open_txs:
+        yield conn
+        return
+    # The lock is already held if this thread has a transaction on another connection.
+    lock = _tx_lock if not open_txs else nullcontext()
+    with lock:
+        conn.execute("BEGIN IMMEDIATE")
+        open_txs.add(id(conn))
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            open_txs.discard(id(conn))
+
+
+def _require_transaction(conn: sqlite3.Connection) -> None:
+    if id(conn) not in _open_txs():
+        raise RuntimeError("must be called inside db.transaction()")
+
+
 def init_db(conn: sqlite3.Connection) -> None:
     conn.executescript(
         """
@@ -67,17 +134,20 @@ def init_db(conn: sqlite3.Connection) -> None:
             created_at TEXT NOT NULL,
             FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE CASCADE
         );
+
+        CREATE INDEX IF NOT EXISTS idx_items_order ON order_items(order_id);
+        CREATE INDEX IF NOT EXISTS idx_updates_order ON order_updates(order_id);
         """
     )
     conn.commit()
 
 
 def create_customer(conn: sqlite3.Connection, name: str, phone: str | None = None) -> int:
-    cur = conn.execute(
-        "INSERT INTO customers(name, phone, created_at) VALUES (?, ?, ?)",
-        (name.strip(), (phone or "").strip() or None, utc_now_iso()),
-    )
-    conn.commit()
+    with transaction(conn):
+        cur = conn.execute(
+            "INSERT INTO customers(name, phone, created_at) VALUES (?, ?, ?)",
+            (name.strip(), (phone or "").strip() or None, utc_now_iso()),
+        )
     return int(cur.lastrowid)
 
 
@@ -89,19 +159,19 @@ def create_order(
     notes: str | None = None,
 ) -> int:
     now = utc_now_iso()
-    cur = conn.execute(
-        """
-        INSERT INTO orders(customer_id, status, delivery_type, address, notes, created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (customer_id, "draft", delivery_type, address, notes, now, now),
-    )
-    order_id = int(cur.lastrowid)
-    conn.execute(
-        "INSERT INTO order_updates(order_id, status, message, created_at) VALUES (?, ?, ?, ?)",
-        (order_id, "draft", "Order created", now),
-    )
-    conn.commit()
+    with transaction(conn):
+        cur = conn.execute(
+            """
+            INSERT INTO orders(customer_id, status, delivery_type, address, notes, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (customer_id, "draft", delivery_type, address, notes, now, now),
+        )
+        order_id = int(cur.lastrowid)
+        conn.execute(
+            SQL_INSERT_UPDATE,
+            (order_id, "draft", "Order created", now),
+        )
     return order_id
 
 
@@ -115,11 +185,11 @@ def add_order_item(
     unit_price: int,
     size: str | None = None,
 ) -> int:
+    """Insert one item. Must be called inside db.transaction()."""
+    _require_transaction(conn)
+    now = utc_now_iso()
     cur = conn.execute(
-        """
-        INSERT INTO order_items(order_id, item_type, item_id, item_name, size, qty, unit_price, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
+        SQL_INSERT_ITEM,
         (
             order_id,
             item_type,
@@ -128,51 +198,137 @@ def add_order_item(
             size,
             int(qty),
             int(unit_price),
-            utc_now_iso(),
+            now,
         ),
     )
-    conn.execute("UPDATE orders SET updated_at=? WHERE id=?", (utc_now_iso(), order_id))
-    conn.commit()
+    conn.execute(SQL_TOUCH_ORDER, (now, order_id))
     return int(cur.lastrowid)
 
 
+def add_order_items_bulk(conn: sqlite3.Connection, order_id: int, items: Iterable[dict[str, Any]]) -> None:
+    """Insert several items at once. Must be called inside db.transaction()."""
+    _require_transaction(conn)
+    now = utc_now_iso()
+    conn.executemany(
+        SQL_INSERT_ITEM,
+        [
+            (
+                int(order_id),
+                it["item_type"],
+                it["item_id"],
+                it["item_name"],
+                it.get("size"),
+                int(it["qty"]),
+                int(it["unit_price"]),
+                now,
+            )
+            for it in items
+        ],
+    )
+    conn.execute(SQL_TOUCH_ORDER, (now, int(order_id)))
+
+
 def remove_order_item(conn: sqlite3.Connection, order_item_id: int) -> None:
-    conn.execute("DELETE FROM order_items WHERE id=?", (int(order_item_id),))
-    conn.commit()
+    with transaction(conn):
+        conn.execute("DELETE FROM order_items WHERE id=?", (int(order_item_id),))
 
 
 def set_order_status(conn: sqlite3.Connection, order_id: int, status: str, message: str | None = None) -> None:
+    """Update status and log it. Must be called inside db.transaction()."""
+    _require_transaction(conn)
     now = utc_now_iso()
     conn.execute("UPDATE orders SET status=?, updated_at=? WHERE id=?", (status, now, int(order_id)))
     conn.execute(
-        "INSERT INTO order_updates(order_id, status, message, created_at) VALUES (?, ?, ?, ?)",
+        SQL_INSERT_UPDATE,
         (int(order_id), status, message, now),
     )
-    conn.commit()
+
+
+# Items and updates come back as JSON arrays built by SQLite, so a whole
+# order payload is a single row.
+_ORDER_PAYLOAD_SELECT = """
+    SELECT
+        o.*,
+        (
+            SELECT json_group_array(json_object(
+                'id', i.id,
+                'order_id', i.order_id,
+                'item_type', i.item_type,
+                'item_id', i.item_id,
+                'item_name', i.item_name,
+                'size', i.size,
+                'qty', i.qty,
+                'unit_price', i.unit_price,
+                'created_at', i.created_at
+            ))
+            FROM (SELECT * FROM order_items WHERE order_id = o.id ORDER BY id ASC) AS i
+        ) AS items_json,
+        (
+            SELECT json_group_array(json_object(
+                'id', u.id,
+                'order_id', u.order_id,
+                'status', u.status,
+                'message', u.message,
+                'created_at', u.created_at
+            ))
+            FROM (SELECT * FROM order_updates WHERE order_id = o.id ORDER BY id ASC) AS u
+        ) AS updates_json
+    FROM orders AS o
+"""
+
+SQL_GET_ORDER = _ORDER_PAYLOAD_SELECT + "WHERE o.id = ?"
+SQL_GET_ORDERS_BULK = (
+    _ORDER_PAYLOAD_SELECT + "WHERE o.id IN (SELECT value FROM json_each(?)) ORDER BY o.id DESC"
+)
+
+
+def _order_payload(row: sqlite3.Row) -> dict[str, Any]:
+    order = dict(row)
+    items = json.loads(order.pop("items_json"))
+    updates = json.loads(order.pop("updates_json"))
+    return {
+        "order": order,
+        "items": items,
+        "updates": updates,
+    }
 
 
 def get_order(conn: sqlite3.Connection, order_id: int) -> dict[str, Any] | None:
-    row = conn.execute("SELECT * FROM orders WHERE id=?", (int(order_id),)).fetchone()
+    row = conn.execute(SQL_GET_ORDER, (int(order_id),)).fetchone()
     if row is None:
         return None
-    items = conn.execute(
-        "SELECT * FROM order_items WHERE order_id=? ORDER BY id ASC", (int(order_id),)
-    ).fetchall()
-    updates = conn.execute(
-        "SELECT * FROM order_updates WHERE order_id=? ORDER BY id ASC", (int(order_id),)
-    ).fetchall()
-    return {
-        "order": dict(row),
-        "items": [dict(i) for i in items],
-        "updates": [dict(u) for u in updates],
-    }
+    return _order_payload(row)
+
+
+def get_orders_bulk(conn: sqlite3.Connection, order_ids: Iterable[int]) -> list[dict[str, Any]]:
+    # All requested orders in one query; ids are bound as a single JSON array.
+    ids = json.dumps([int(i) for i in order_ids])
+    rows = conn.execute(SQL_GET_ORDERS_BULK, (ids,)).fetchall()
+    return [_order_payload(r) for r in rows]
+
+
+def get_order_summary(conn: sqlite3.Connection, order_id: int) -> dict[str, Any] | None:
+    # Order row plus its item count, without fetching the items themselves.
+    row = conn.execute(
+        """
+        SELECT o.*, (SELECT COUNT(*) FROM order_items WHERE order_id = o.id) AS item_count
+        FROM orders AS o
+        WHERE o.id = ?
+        """,
+        (int(order_id),),
+    ).fetchone()
+    return dict(row) if row is not None else None
 
 
 def list_orders(conn: sqlite3.Connection, limit: int = 50) -> list[dict[str, Any]]:
-    rows = conn.execute(
-        "SELECT * FROM orders ORDER BY id DESC LIMIT ?", (int(limit),)
-    ).fetchall()
-    return [dict(r) for r in rows]
+    # Row dicts keep NULLs as None; list_orders_df would turn them into NaN.
+    return [dict(r) for r in conn.execute(SQL_LIST_ORDERS, (int(limit),)).fetchall()]
+
+
+def list_orders_df(conn: sqlite3.Connection, limit: int = 50) -> pd.DataFrame:
+    cur = conn.execute(SQL_LIST_ORDERS, (int(limit),))
+    cols = [d[0] for d in cur.description]
+    return pd.DataFrame.from_records(cur.fetchall(), columns=cols)
 
 
 def compute_totals(
@@ -180,9 +336,28 @@ def compute_totals(
     delivery_fee: int,
     tax_percent: float,
 ) -> OrderTotals:
+    # Plain loop on purpose: callers pass one order's items, far below the size
+    # where a numpy dot product (after converting the dicts) could pay off.
     subtotal = 0
     for item in items:
         subtotal += int(item["qty"]) * int(item["unit_price"])
     tax = int(round(subtotal * float(tax_percent)))
     total = subtotal + int(delivery_fee) + tax
     return OrderTotals(subtotal=subtotal, delivery_fee=int(delivery_fee), tax=tax, total=total)
+
+
+def compute_totals_sql(
+    conn: sqlite3.Connection,
+    order_id: int,
+    delivery_fee: int,
+    tax_percent: float,
+) -> OrderTotals:
+    subtotal = int(
+        conn.execute(
+            "SELECT COALESCE(SUM(qty * unit_price), 0) FROM order_items WHERE order_id=?",
+            (int(order_id),),
+        ).fetchone()[0]
+    )
+    tax = int(round(subtotal * float(tax_percent)))
+    total = subtotal + int(delivery_fee) + tax
+    return OrderTotals(subtotal=subtotal, delivery_fee=int(delivery_fee), tax=tax, total=total)
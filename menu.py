@@ -1,21 +1,45 @@
 import json
 from dataclasses import dataclass
+from functools import cached_property
 from pathlib import Path
 from typing import Any
 
 
+SIZE_ORDER = ("small", "medium", "large")
+SIZE_INDEX = {size: i for i, size in enumerate(SIZE_ORDER)}
+
+
 @dataclass(frozen=True)
 class Menu:
     data: dict[str, Any]
 
-    @property
+    @cached_property
     def pizzas(self) -> list[dict[str, Any]]:
         return list(self.data.get("pizzas", []))
 
-    @property
+    @cached_property
     def extras(self) -> list[dict[str, Any]]:
         return list(self.data.get("extras", []))
 
+    @cached_property
+    def pizzas_by_id(self) -> dict[str, dict[str, Any]]:
+        return {str(p.get("id", "")).lower(): p for p in self.pizzas}
+
+    @cached_property
+    def prices_by_id(self) -> dict[str, tuple[int | None, ...]]:
+        # Per-pizza prices in SIZE_ORDER, coerced to int once; None for a missing size.
+        prices: dict[str, tuple[int | None, ...]] = {}
+        for pid, p in self.pizzas_by_id.items():
+            sizes = p.get("sizes", {})
+            prices[pid] = tuple(
+                int(sizes[size]) if sizes.get(size) is not None else None for size in SIZE_ORDER
+            )
+        return prices
+
+    @cached_property
+    def extras_by_id(self) -> dict[str, dict[str, Any]]:
+        return {str(e.get("id", "")).lower(): e for e in self.extras}
+
     @property
     def delivery_fee(self) -> int:
         return int(self.data.get("delivery_fee", 0))
@@ -24,6 +48,10 @@ class Menu:
     def tax_percent(self) -> float:
         return float(self.data.get("tax_percent", 0))
 
+    @cached_property
+    def menu_text(self) -> str:
+        return format_menu_for_chat(self)
+
 
 def load_menu(menu_path: str) -> Menu:
     raw = json.loads(Path(menu_path).read_text(encoding="utf-8"))
@@ -48,16 +76,8 @@ def format_menu_for_chat(menu: Menu) -> str:
 
 
 def find_pizza(menu: Menu, pizza_id: str) -> dict[str, Any] | None:
-    pid = pizza_id.strip().lower()
-    for p in menu.pizzas:
-        if str(p.get("id", "")).lower() == pid:
-            return p
-    return None
+    return menu.pizzas_by_id.get(pizza_id.strip().lower())
 
 
 def find_extra(menu: Menu, extra_id: str) -> dict[str, Any] | None:
-    eid = extra_id.strip().lower()
-    for e in menu.extras:
-        if str(e.get("id", "")).lower() == eid:
-            return e
-    return None
+    return menu.extras_by_id.get(extra_id.strip().lower())